@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+import sympy as sp
+
+from utils import evaluate_function, parse_function
+
+
+@pytest.mark.parametrize("payload", [
+    "__import__('os').environ.__setitem__('SUPEK_PWNED', '1')",
+    "exp(\"__import__('os').environ.__setitem__('SUPEK_PWNED', '1') or x\")",
+    "Abs('__import__(\"os\").environ.__setitem__(\"SUPEK_PWNED\", \"1\")')",
+    "Max(x, '__import__(\"os\").environ.__setitem__(\"SUPEK_PWNED\", \"1\")')",
+    "().__class__",
+    "Symbol('y')",
+    "Function('f')(x)",
+])
+def test_parse_function_rejects_code_payloads(payload):
+    with pytest.raises(sp.SympifyError):
+        parse_function(payload)
+    assert 'SUPEK_PWNED' not in os.environ
+
+
+@pytest.mark.parametrize("function_str", ["foo(x)", "xsin(x)", "pix", "x*y", "x+)", "x<2"])
+def test_parse_function_rejects_invalid_input(function_str):
+    with pytest.raises(sp.SympifyError):
+        parse_function(function_str)
+
+
+def test_parse_function_implicit_multiplication():
+    x = sp.Symbol('x')
+    assert parse_function("2x + sin x") == 2 * x + sp.sin(x)
+    assert parse_function("x^2 + pi/3") == x**2 + sp.pi / 3
+
+
+@pytest.mark.parametrize("function_str", [
+    "sqrt(x)", "abs(x)", "cbrt(x)", "x % 3", "pi*x", "e^x", "10^(x)",
+    "sin(x)", "cos(x)", "tan(x)", "csc(x)", "sec(x)", "cot(x)",
+    "asin(x)", "acos(x)", "atan(x)", "sinh(x)", "cosh(x)", "tanh(x)",
+    "exp(x)", "log(x)", "log10(x)", "log2(x)",
+])
+def test_parse_function_accepts_keypad_functions(function_str):
+    assert parse_function(function_str).free_symbols == {sp.Symbol('x')}
+
+
+@pytest.mark.parametrize("expr", [
+    sp.Symbol('x') + sp.Symbol('y'),
+    sp.Function('f')(sp.Symbol('x')),
+    sp.Eq(sp.Symbol('x'), 1),
+])
+def test_evaluate_function_rejects_invalid_expressions(expr):
+    with pytest.raises(sp.SympifyError):
+        evaluate_function(expr, np.arange(3.0))
@@ -1,30 +1,212 @@
+import io
+import tokenize
+from functools import lru_cache
+
 import numpy as np
 import sympy as sp
-from scipy.interpolate import interp1d
+from sympy.core.function import AppliedUndef
+from sympy.parsing.sympy_parser import (
+    convert_xor,
+    implicit_application,
+    implicit_multiplication,
+    parse_expr,
+    standard_transformations,
+)
 
-def evaluate_function(function_str, x_values):
+# Parser transformations: allow implicit multiplication ("2x") and application
+# ("sin x") and ^ for powers. split_symbols is left out so that unknown names
+# such as "foo" are rejected instead of being split into f*o*o.
+TRANSFORMS = standard_transformations + (implicit_multiplication, implicit_application, convert_xor)
+
+# Functions and constants a function string may use; this covers every
+# function and constant button on the MathInputKeypad component
+ALLOWED_NAMES = {
+    name: getattr(sp, name)
+    for name in (
+        'sin', 'cos', 'tan', 'cot', 'sec', 'csc',
+        'asin', 'acos', 'atan', 'sinh', 'cosh', 'tanh', 'asinh', 'acosh', 'atanh',
+        'exp', 'log', 'sqrt', 'cbrt', 'Abs', 'sign', 'floor', 'ceiling', 'Max', 'Min',
+        'pi', 'E',
+    )
+}
+ALLOWED_NAMES.update({
+    'abs': sp.Abs,
+    'ln': sp.log,
+    'log10': lambda arg: sp.log(arg, 10),
+    'log2': lambda arg: sp.log(arg, 2),
+    'e': sp.E,
+})
+
+# Names the parser transformations emit into the generated code
+_PARSER_NAMES = {name: getattr(sp, name) for name in ('Integer', 'Float', 'Rational')}
+
+def parse_function(function_str):
     """
-    Evaluate a mathematical function string for given x values.
+    Parse a mathematical function string into a sympy expression of x.
+    
+    The string may only use x, numbers, operators and ALLOWED_NAMES; it is
+    evaluated without Python builtins, and string literals, attribute
+    access and any other names are rejected.
     
     Args:
         function_str (str): The function as a string, e.g., "sin(x) + x^2"
-        x_values (np.ndarray): Array of x values to evaluate the function at
     
     Returns:
-        np.ndarray: Array of y values
+        sp.Expr: The parsed expression
+    
+    Raises:
+        sp.SympifyError: If the string is not a valid function of x
+    """
+    x = sp.Symbol('x')
+    
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(function_str).readline))
+    except (tokenize.TokenError, SyntaxError) as e:
+        raise sp.SympifyError(function_str, e)
+    # Only x and ALLOWED_NAMES may appear; string literals are rejected because
+    # sympy sympifies string arguments with full Python builtins
+    for tok in tokens:
+        if tok.type == tokenize.STRING:
+            raise sp.SympifyError(function_str, ValueError("string literals are not allowed"))
+        if tok.type == tokenize.NAME and tok.string != 'x' and tok.string not in ALLOWED_NAMES:
+            raise sp.SympifyError(function_str, ValueError(f"unknown name: {tok.string}"))
+        if tok.type == tokenize.OP and tok.string == '.':
+            raise sp.SympifyError(function_str, ValueError("attribute access is not allowed"))
+    
+    global_dict = {'__builtins__': {}, **_PARSER_NAMES, **ALLOWED_NAMES}
+    try:
+        expr = parse_expr(function_str, local_dict={'x': x}, global_dict=global_dict, transformations=TRANSFORMS)
+    except Exception as e:
+        raise sp.SympifyError(function_str, e)
+    
+    return _check_expression(expr, function_str)
+
+def _check_expression(expr, source=None):
+    """
+    Check that a parsed expression is a function of x alone.
+    
+    Args:
+        expr: The parsed expression
+        source (str, optional): The string expr was parsed from, for error messages
+    
+    Returns:
+        sp.Expr: expr, unchanged
+    
+    Raises:
+        sp.SympifyError: If expr is not an expression, has free symbols other
+            than x, or uses undefined functions
+    """
+    if source is None:
+        source = expr
+    if not isinstance(expr, sp.Expr):
+        raise sp.SympifyError(source, ValueError("not a mathematical expression"))
+    unknown = expr.free_symbols - {sp.Symbol('x')}
+    if unknown:
+        names = ', '.join(sorted(str(s) for s in unknown))
+        raise sp.SympifyError(source, ValueError(f"unknown symbols: {names}"))
+    undefined = expr.atoms(AppliedUndef)
+    if undefined:
+        names = ', '.join(sorted(str(f.func) for f in undefined))
+        raise sp.SympifyError(source, ValueError(f"unknown functions: {names}"))
+    return expr
+
+def _expanded_degree(expr, x):
+    """
+    Get the degree of an already-expanded polynomial in x.
+    
+    Args:
+        expr (sp.Expr): The expression to inspect
+        x (sp.Symbol): The polynomial variable
+    
+    Returns:
+        int or None: The degree, or None if expr is not a sum of terms
+            c * x**k with numeric c and non-negative integer k
+    """
+    if not expr.is_Add:
+        return None
+    degree = 0
+    for term in expr.args:
+        coeff, monomial = term.as_coeff_Mul()
+        if monomial == 1:
+            continue
+        if monomial == x:
+            k = 1
+        elif monomial.is_Pow and monomial.base == x and monomial.exp.is_Integer and monomial.exp > 0:
+            k = int(monomial.exp)
+        else:
+            return None
+        degree = max(degree, k)
+    return degree
+
+@lru_cache(maxsize=128)
+def _compile(function):
+    """
+    Parse a function and compile it to a numpy-compatible callable.
+    
+    Results are cached on the normalized function string (or expression), so
+    re-submitting the same function skips the parse and lambdify steps.
+    
+    Args:
+        function (str or sp.Expr): The function as a string with ^ already
+            replaced by **, or an expression from parse_function
+    
+    Returns:
+        callable: Function mapping an array of x values to y values
     """
     x = sp.Symbol('x')
-    # Replace ^ with ** for Python-compatible power notation
-    function_str = function_str.replace('^', '**')
     
-    # Parse the function using sympy
-    expr = sp.sympify(function_str)
+    # Parse the function using sympy; pre-parsed expressions get the same checks
+    expr = parse_function(function) if isinstance(function, str) else _check_expression(function)
+    
+    # Evaluate constant subexpressions (pi/3, sin(1), rationals) to floats once,
+    # instead of on every call of the compiled function
+    expr = expr.evalf()
+    
+    # Expanded polynomials of degree 3 and up are faster under np.polyval than
+    # as lambdified np.power terms; lower degrees and factored forms are not,
+    # and expanding factored forms would also lose accuracy near their roots
+    degree = _expanded_degree(expr, x)
+    if degree is not None and 3 <= degree < 64:
+        try:
+            coeffs = np.array([float(c) for c in sp.Poly(expr, x).all_coeffs()])
+            return lambda x_values: np.polyval(coeffs, x_values)
+        except (sp.PolynomialError, TypeError):
+            pass
+    
+    # Convert the sympy expression to a numpy-compatible function, sharing
+    # common subexpressions between terms
+    return sp.lambdify(x, expr, 'numpy', cse=True)
+
+def compile_function(function):
+    """
+    Get the compiled numpy callable for a mathematical function.
+    
+    Args:
+        function (str or sp.Expr): The function as a string, e.g., "sin(x) + x^2",
+            or an expression already returned by parse_function
+    
+    Returns:
+        callable: Function mapping an array of x values to y values
+    """
+    if isinstance(function, str):
+        # Replace ^ with ** so equivalent spellings share a cache entry
+        function = function.replace('^', '**')
+    return _compile(function)
+
+def evaluate_function(function_str, x_values):
+    """
+    Evaluate a mathematical function string for given x values.
     
-    # Convert the sympy expression to a numpy-compatible function
-    f = sp.lambdify(x, expr, 'numpy')
+    Args:
+        function_str (str or sp.Expr): The function as a string, e.g., "sin(x) + x^2",
+            or an expression already returned by parse_function
+        x_values (np.ndarray): Array of x values to evaluate the function at
     
+    Returns:
+        np.ndarray: Array of y values
+    """
     # Evaluate the function for each x value
-    return f(x_values)
+    return compile_function(function_str)(x_values)
 
 def calculate_mse(predicted, actual):
     """
@@ -37,52 +219,90 @@ def calculate_mse(predicted, actual):
     Returns:
         float: The MSE value
     """
-    return np.mean((predicted - actual) ** 2)
+    diff = np.subtract(predicted, actual).ravel()
+    
+    # The mean of no values is undefined, as with np.mean
+    if diff.size == 0:
+        return np.nan
+    
+    # dot fuses the square and sum without allocating a squared array
+    return float(np.dot(diff, diff)) / diff.size
 
-def sample_points(points, x_samples):
+def _fill_zeros(x_samples, out):
+    """Return zeros shaped like x_samples, reusing out when it is given."""
+    if out is None:
+        return np.zeros_like(x_samples)
+    out.fill(0)
+    return out
+
+def sample_points(x_drawn, y_drawn, x_samples, out=None):
     """
     Sample y values from drawn points at the given x coordinates using interpolation.
     
     Args:
-        points (list): List of (x, y) coordinate tuples from user drawing
+        x_drawn (np.ndarray): Array of x coordinates from user drawing
+        y_drawn (np.ndarray): Array of y coordinates from user drawing
         x_samples (np.ndarray): Array of x coordinates to sample at
+        out (np.ndarray, optional): Preallocated array to write the y values into
     
     Returns:
-        np.ndarray: Array of interpolated y values
-    """
-    if not points:
-        return np.zeros_like(x_samples)
+        np.ndarray: Array of interpolated y values (out, if given)
     
-    # Extract x and y arrays from the points
-    x_drawn = np.array([p[0] for p in points])
-    y_drawn = np.array([p[1] for p in points])
+    Raises:
+        ValueError: If x_drawn and y_drawn, or out and x_samples, differ in shape
+    """
+    x_drawn = np.asarray(x_drawn, dtype=np.float64)
+    y_drawn = np.asarray(y_drawn, dtype=np.float64)
+    x_samples = np.asarray(x_samples, dtype=np.float64)
     
-    # Remove duplicate x values (keep the last occurrence)
-    unique_indices = []
-    seen_x = set()
-    for i in range(len(x_drawn) - 1, -1, -1):
-        if x_drawn[i] not in seen_x:
-            unique_indices.append(i)
-            seen_x.add(x_drawn[i])
+    if x_drawn.ndim != 1 or x_drawn.shape != y_drawn.shape:
+        raise ValueError(
+            f"x_drawn and y_drawn must be 1-D arrays of the same shape, got {x_drawn.shape} and {y_drawn.shape}"
+        )
+    if out is not None and out.shape != x_samples.shape:
+        raise ValueError(f"out must have the shape of x_samples {x_samples.shape}, got {out.shape}")
     
-    unique_indices.reverse()
-    x_unique = x_drawn[unique_indices]
-    y_unique = y_drawn[unique_indices]
+    if x_drawn.size == 0:
+        return _fill_zeros(x_samples, out)
     
-    # Sort by x coordinate
-    sort_idx = np.argsort(x_unique)
-    x_unique = x_unique[sort_idx]
-    y_unique = y_unique[sort_idx]
+    # Remove duplicate x values (keep the last occurrence); np.unique on the
+    # reversed arrays finds the last occurrence and returns x sorted
+    x_unique, last_idx = np.unique(x_drawn[::-1], return_index=True)
+    y_unique = y_drawn[::-1][last_idx]
     
     # Check if we have enough points for interpolation
     if len(x_unique) < 2:
         # Not enough points for interpolation, return zeros
-        return np.zeros_like(x_samples)
+        return _fill_zeros(x_samples, out)
     
-    # Create interpolation function
-    f = interp1d(x_unique, y_unique, kind='linear', bounds_error=False, fill_value=(y_unique[0], y_unique[-1]))
+    # Sample y values at the requested x coordinates, holding the end values
+    # constant outside the drawn range
+    y_samples = np.interp(x_samples, x_unique, y_unique, left=y_unique[0], right=y_unique[-1])
     
-    # Sample y values at the requested x coordinates
-    y_samples = f(x_samples)
+    if out is None:
+        return y_samples
+    np.copyto(out, y_samples)
+    return out
+
+def score(function_str, x_drawn, y_drawn, x_min, x_max, n_samples=100):
+    """
+    Score a user drawing against a mathematical function.
+    
+    Args:
+        function_str (str): The function as a string, e.g., "sin(x) + x^2"
+        x_drawn (np.ndarray): Array of x coordinates from user drawing
+        y_drawn (np.ndarray): Array of y coordinates from user drawing
+        x_min (float): Lower bound of the x range
+        x_max (float): Upper bound of the x range
+        n_samples (int): Number of x values to compare at
+    
+    Returns:
+        float: Score between 0 and 100, where 100 is a perfect match
+    """
+    x_values = np.linspace(x_min, x_max, n_samples)
+    y_values = evaluate_function(function_str, x_values)
+    user_samples = sample_points(x_drawn, y_drawn, x_values)
+    mse = calculate_mse(user_samples, y_values)
     
-    return y_samples
+    # An MSE of 100 or more scores zero
+    return 100.0 * max(0.0, 1.0 - min(1.0, mse * 0.01))